@@ -1,42 +1,72 @@
-import json
 import os
 import hashlib
-import boto3
+import orjson
+from urllib.parse import quote
+from urllib.request import Request, urlopen
+from collections import OrderedDict
 from typing import Dict, Any, List
-from google import genai
+
+# llm.py reads GEMINI_MODEL when it is imported, so export the model name once here first
+MODEL_NAME = os.environ.get("MODEL_NAME", "gemini-2.5-flash")
+os.environ["GEMINI_MODEL"] = MODEL_NAME
 
 # Import shared modules
 from llm import chat_answer
 
 # Initialize AWS clients
 SECRET_NAME = os.environ.get("GEMINI_SECRET_NAME", "prod/gemini/api_key")
-MODEL_NAME = os.environ.get("MODEL_NAME", "gemini-2.5-flash")
-REGION = os.environ.get("AWS_REGION") or os.environ.get("AWS_DEFAULT_REGION")
+# Port of the AWS Parameters and Secrets Lambda Extension (attached as a layer)
+SECRETS_EXTENSION_PORT = os.environ.get("PARAMETERS_SECRETS_EXTENSION_HTTP_PORT", "2773")
 
 _API_KEY_CACHE = None
 _CLIENT_CACHE = None
 
+# Set WARM_ON_INIT=0 to skip pre-loading the Gemini client during Lambda init (see bottom of module)
+WARM_ON_INIT = os.environ.get("WARM_ON_INIT", "1") == "1"
+
 # Cache directories in Lambda ephemeral storage
 CACHE_DIR = "/tmp/paper_cache"
 CHAT_DIR = "/tmp/chat_cache"
 
+# Request bodies are a few hundred bytes of JSON; reject anything this large before parsing it
+MAX_BODY_CHARS = 1_000_000
+
+# Response headers, built once per container and shared (read-only) by every response
+RESPONSE_HEADERS = {
+    # 'Access-Control-Allow-Origin': '*',
+    'Access-Control-Allow-Headers': 'Content-Type',
+    'Access-Control-Allow-Methods': 'POST, OPTIONS'
+}
+
+# Chat histories kept in memory for the lifetime of a warm container, keyed by chat file path,
+# LRU-bounded; evicted sessions are rebuilt from their .jsonl log on next use
+HISTORY_MEM_MAX_ENTRIES = 128
+_HISTORY_MEM: "OrderedDict[str, List[Dict[str, str]]]" = OrderedDict()
+
 
 def _get_api_key():
-    """Fetch and cache the API key from Secrets Manager."""
+    """Fetch and cache the API key via the AWS Parameters and Secrets Lambda Extension."""
     global _API_KEY_CACHE
     if _API_KEY_CACHE:
         return _API_KEY_CACHE
 
     try:
-        sm = boto3.client("secretsmanager", region_name=REGION)
-        print(f"Fetching secret: {SECRET_NAME} from region: {REGION}")
-        sec = sm.get_secret_value(SecretId=SECRET_NAME)
+        # The extension serves (and caches) secrets on localhost, so no boto3 client or
+        # signed Secrets Manager call is needed on cold start
+        secret_url = (
+            f"http://localhost:{SECRETS_EXTENSION_PORT}/secretsmanager/get"
+            f"?secretId={quote(SECRET_NAME, safe='')}"
+        )
+        req = Request(secret_url, headers={"X-Aws-Parameters-Secrets-Token": os.environ["AWS_SESSION_TOKEN"]})
+        print(f"Fetching secret: {SECRET_NAME} via Lambda extension on port {SECRETS_EXTENSION_PORT}")
+        with urlopen(req, timeout=5) as resp:
+            sec = orjson.loads(resp.read())
         s = sec["SecretString"]
         print(f"Secret fetched successfully, length: {len(s) if s else 0}")
 
         # Support either a bare string or a simple JSON structure
         try:
-            data = json.loads(s)
+            data = orjson.loads(s)
             print(f"Secret is JSON with keys: {list(data.keys()) if data else []}")
             api_key = data.get("GEMINI_API_KEY") or next(iter(data.values()))
         except Exception as json_error:
@@ -47,9 +77,6 @@ def _get_api_key():
             raise ValueError("API key is empty")
             
         _API_KEY_CACHE = api_key.strip()
-        
-        # Set the environment variable so llm.py can use it
-        os.environ["GEMINI_API_KEY"] = _API_KEY_CACHE
         print(f"API key cached successfully, length: {len(_API_KEY_CACHE)}")
         
         return _API_KEY_CACHE
@@ -64,62 +91,100 @@ def _get_client():
     if _CLIENT_CACHE:
         return _CLIENT_CACHE
     
-    # Ensure API key is set in environment
+    # Ensure API key is available
     api_key = _get_api_key()
+    from google import genai  # imported lazily to keep init light
     _CLIENT_CACHE = genai.Client(api_key=api_key)
     return _CLIENT_CACHE
 
 
+def _cache_key(value: str) -> str:
+    """Filesystem-safe cache key; BLAKE2b is cheaper than MD5 for short inputs"""
+    return hashlib.blake2b(value.encode(), digest_size=16).hexdigest()
+
+
 def get_cached_paper(url: str) -> Dict[str, Any] | None:
     """Retrieve cached paper data from ephemeral storage"""
-    cache_key = hashlib.md5(url.encode()).hexdigest()
+    cache_key = _cache_key(url)
     cache_file = f"{CACHE_DIR}/{cache_key}.json"
     
     if os.path.exists(cache_file):
         try:
-            with open(cache_file, 'r', encoding='utf-8') as f:
-                return json.load(f)
+            with open(cache_file, 'rb') as f:
+                return orjson.loads(f.read())
         except Exception:
             return None
     
     return None
 
 
+def _chat_file(session_id: str, url: str) -> str:
+    chat_key = _cache_key(f"{session_id}:{url}")
+    return f"{CHAT_DIR}/{chat_key}.jsonl"
+
+
+def _read_chat_file(chat_file: str) -> List[Dict[str, str]]:
+    """Read a JSON-lines chat log, skipping any torn/partial lines"""
+    history: List[Dict[str, str]] = []
+    if not os.path.exists(chat_file):
+        return history
+    try:
+        with open(chat_file, 'rb') as f:
+            for line in f:
+                try:
+                    history.append(orjson.loads(line))
+                except orjson.JSONDecodeError:
+                    continue
+    except Exception:
+        return []
+    return history
+
+
+def _remember_history(chat_file: str, history: List[Dict[str, str]]) -> None:
+    """Keep a chat history in memory, evicting the least recently used"""
+    _HISTORY_MEM[chat_file] = history
+    _HISTORY_MEM.move_to_end(chat_file)
+    while len(_HISTORY_MEM) > HISTORY_MEM_MAX_ENTRIES:
+        _HISTORY_MEM.popitem(last=False)
+
+
 def get_chat_history(session_id: str, url: str) -> List[Dict[str, str]]:
-    """Retrieve chat history from ephemeral storage"""
-    os.makedirs(CHAT_DIR, exist_ok=True)
-    chat_key = hashlib.md5(f"{session_id}:{url}".encode()).hexdigest()
-    chat_file = f"{CHAT_DIR}/{chat_key}.json"
-    
-    if os.path.exists(chat_file):
-        try:
-            with open(chat_file, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except Exception:
-            return []
-    
-    return []
+    """Retrieve chat history from the warm-container cache or ephemeral storage"""
+    chat_file = _chat_file(session_id, url)
+    history = _HISTORY_MEM.get(chat_file)
+    if history is None:
+        history = _read_chat_file(chat_file)
+    _remember_history(chat_file, history)
+    # Return a copy so callers can append before deciding to save
+    return list(history)
 
 
 def save_chat_history(session_id: str, url: str, history: List[Dict[str, str]]) -> None:
-    """Save chat history to ephemeral storage"""
+    """Append new turns to ephemeral storage and refresh the warm-container cache"""
     os.makedirs(CHAT_DIR, exist_ok=True)
-    chat_key = hashlib.md5(f"{session_id}:{url}".encode()).hexdigest()
-    chat_file = f"{CHAT_DIR}/{chat_key}.json"
-    
-    with open(chat_file, 'w', encoding='utf-8') as f:
-        json.dump(history, f)
+    chat_file = _chat_file(session_id, url)
+    saved = _HISTORY_MEM.get(chat_file)
+    if saved is None:
+        saved = _read_chat_file(chat_file)
+
+    # History is append-only, so only turns past what is already on disk need writing
+    new_turns = history[len(saved):]
+    if new_turns:
+        with open(chat_file, 'ab') as f:
+            f.write(b"".join(orjson.dumps(turn) + b"\n" for turn in new_turns))
+    _remember_history(chat_file, list(history))
+
+
+def _dumps(obj: Any) -> str:
+    """Serialize a response body; orjson returns bytes, Lambda wants str"""
+    return orjson.dumps(obj).decode()
 
 
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     """Lambda handler for chat functionality"""
     
-    # Set up CORS headers
-    headers = {
-        # 'Access-Control-Allow-Origin': '*',
-        'Access-Control-Allow-Headers': 'Content-Type',
-        'Access-Control-Allow-Methods': 'POST, OPTIONS'
-    }
+    # CORS headers
+    headers = RESPONSE_HEADERS
     
     # Handle OPTIONS request for CORS preflight
     if event.get('httpMethod') == 'OPTIONS':
@@ -133,14 +198,20 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         # Parse request body
         if 'body' in event:
             if isinstance(event['body'], str):
-                body = json.loads(event['body'])
+                if len(event['body']) > MAX_BODY_CHARS:
+                    return {
+                        'statusCode': 413,
+                        'headers': headers,
+                        'body': _dumps({'error': 'Request body too large'})
+                    }
+                body = orjson.loads(event['body'])
             else:
                 body = event['body']
         else:
             return {
                 'statusCode': 400,
                 'headers': headers,
-                'body': json.dumps({'error': 'Missing request body'})
+                'body': _dumps({'error': 'Missing request body'})
             }
         
         # Extract parameters
@@ -153,31 +224,26 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             return {
                 'statusCode': 400,
                 'headers': headers,
-                'body': json.dumps({'error': 'Missing paper_url or message'})
+                'body': _dumps({'error': 'Missing paper_url or message'})
             }
         
         if not session_id:
             return {
                 'statusCode': 400,
                 'headers': headers,
-                'body': json.dumps({'error': 'Missing session_id'})
+                'body': _dumps({'error': 'Missing session_id'})
             }
         
         # Set Gemini API key from Secrets Manager
         try:
             # Initialize client and ensure API key is available
             client = _get_client()
-            
-            # Also set the model name if provided
-            if MODEL_NAME:
-                os.environ["GEMINI_MODEL"] = MODEL_NAME
-                
         except Exception as e:
             print(f"Error initializing Gemini client: {str(e)}")
             return {
                 'statusCode': 500,
                 'headers': headers,
-                'body': json.dumps({'error': f'Failed to initialize Gemini client: {str(e)}'})
+                'body': _dumps({'error': f'Failed to initialize Gemini client: {str(e)}'})
             }
         
         # Check if paper is cached
@@ -186,7 +252,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             return {
                 'statusCode': 400,
                 'headers': headers,
-                'body': json.dumps({'error': 'Please summarize the paper first'})
+                'body': _dumps({'error': 'Please summarize the paper first'})
             }
         
         # Get chat history
@@ -198,7 +264,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         try:
             # Generate response using LLM
             text_context = cached_paper["text"]
-            answer = chat_answer(text_context, history)
+            answer = chat_answer(text_context, history, client=client)
             
             # Add model response to history
             history.append({"role": "model", "text": answer})
@@ -209,7 +275,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             return {
                 'statusCode': 200,
                 'headers': headers,
-                'body': json.dumps({
+                'body': _dumps({
                     'success': True,
                     'answer': answer,
                     'session_id': session_id
@@ -225,7 +291,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             return {
                 'statusCode': 500,
                 'headers': headers,
-                'body': json.dumps({'error': f'Error generating response: {str(e)}'})
+                'body': _dumps({'error': f'Error generating response: {str(e)}'})
             }
         
     except Exception as e:
@@ -233,5 +299,14 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         return {
             'statusCode': 500,
             'headers': headers,
-            'body': json.dumps({'error': f'Internal server error: {str(e)}'})
-        }
\ No newline at end of file
+            'body': _dumps({'error': f'Internal server error: {str(e)}'})
+        }
+
+# Fetch the secret and build the Gemini client during Lambda init (once per container)
+# rather than on the first request. Failures are only logged so the module still imports;
+# handler() retries through _get_client() and reports the error to the caller.
+if WARM_ON_INIT:
+    try:
+        _get_client()
+    except Exception as e:
+        print(f"Gemini client warm-up during init failed: {str(e)}")
@@ -1,29 +1,51 @@
 import os
 import math
-from typing import List, Dict
-from google import genai
+from typing import List, Dict, Optional, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from google import genai
 
 # Model selection
 # Defaults to Gemini Flash 2.x name. You can change via GEMINI_MODEL env var.
 # If you have access to a specific preview like "gemini-2.5-flash", set it there.
 GEMINI_MODEL = os.environ.get("GEMINI_MODEL", "gemini-2.5-flash")
 
+# Global client cache for reuse
+_GLOBAL_CLIENT = None
+
 def get_gemini_client():
     """Initialize Gemini client with API key from environment"""
+    global _GLOBAL_CLIENT
+    if _GLOBAL_CLIENT:
+        return _GLOBAL_CLIENT
+        
     GEMINI_API_KEY = os.environ.get("GEMINI_API_KEY")
     
     if not GEMINI_API_KEY:
         raise RuntimeError("GEMINI_API_KEY env var is required")
     
-    return genai.Client(api_key=GEMINI_API_KEY)
+    from google import genai  # imported lazily to keep module import light
+    _GLOBAL_CLIENT = genai.Client(api_key=GEMINI_API_KEY)
+    return _GLOBAL_CLIENT
+
+def set_gemini_client(client):
+    """Set a pre-configured client (useful for Lambda)"""
+    global _GLOBAL_CLIENT
+    _GLOBAL_CLIENT = client
 
 # -------------- Prompt helpers --------------
 from prompts import CHAT_PROMPT
 
+# CHAT_PROMPT has a single {context} slot; pre-split it so the (large) context
+# is spliced in by concatenation instead of re-parsing the template every turn.
+_CHAT_PREFIX, _CHAT_SUFFIX = CHAT_PROMPT.split("{context}")
+
 
-def _call_gemini(contents: List[Dict]) -> str:
+def _call_gemini(contents: List[Dict], client: Optional["genai.Client"] = None) -> str:
     """Low-level call using client.models.generate_content; returns text."""
-    client = get_gemini_client()
+    if client is None:
+        client = get_gemini_client()
+        
     resp = client.models.generate_content(
         model=GEMINI_MODEL,
         contents=contents,
@@ -39,7 +61,7 @@ def _call_gemini(contents: List[Dict]) -> str:
     return text
 
 
-def chat_answer(doc_text: str, history: List[Dict[str, str]], max_context_chars: int = 60000) -> str:
+def chat_answer(doc_text: str, history: List[Dict[str, str]], max_context_chars: int = 60000, client: Optional["genai.Client"] = None) -> str:
     """Answer a user question grounded in doc_text and chat history.
 
     history: list of {role: 'user'|'model', text: str}
@@ -51,10 +73,10 @@ def chat_answer(doc_text: str, history: List[Dict[str, str]], max_context_chars:
     contents: List[Dict] = []
 
     # Add system-like instruction by putting it in the first user message
-    system_user_message = CHAT_PROMPT.format(context=context)
+    system_user_message = _CHAT_PREFIX + context + _CHAT_SUFFIX
     contents.append({"role": "user", "parts": [{"text": system_user_message}]})
 
     for turn in history:
         contents.append({"role": turn["role"], "parts": [{"text": turn["text"]}]})
 
-    return _call_gemini(contents)
+    return _call_gemini(contents, client)
@@ -1,64 +1,131 @@
-import io
 import re
+import shutil
+import tempfile
+import zlib
+from collections import OrderedDict
+from urllib.parse import urlsplit, urlunsplit
 import requests
-from bs4 import BeautifulSoup
-from pdfminer.high_level import extract_text as pdf_extract_text
+from selectolax.lexbor import LexborHTMLParser
+import pypdfium2 as pdfium
 
 HEADERS = {"User-Agent": "Mozilla/5.0 (PaperSummarizerBot)"}
 
-ARXIV_ABS = re.compile(r"https?://arxiv\.org/abs/([\w\.-]+)")
-ARXIV_PDF = re.compile(r"https?://arxiv\.org/pdf/([\w\.-]+)\.pdf")
+# PDFs larger than this are spooled to /tmp instead of being held in memory
+PDF_SPOOL_MAX_BYTES = 1024 * 1024
+STREAM_CHUNK_BYTES = 64 * 1024
+
+# Extracted text memoized per warm container (normalized URL -> zlib level-1 bytes, since
+# paper text compresses several-fold), LRU-bounded
+EXTRACT_MEMO_MAX_ENTRIES = 32
+_EXTRACT_MEMO: "OrderedDict[str, bytes]" = OrderedDict()
+
+# Single pattern for both arXiv forms: group 1 = abs id, group 2 = pdf id
+ARXIV = re.compile(r"https?://arxiv\.org/(?:abs/([\w\.-]+)|pdf/([\w\.-]+)\.pdf)")
 
 
 def _to_arxiv_pdf(url: str) -> str | None:
-    m_abs = ARXIV_ABS.match(url)
-    if m_abs:
-        return f"https://arxiv.org/pdf/{m_abs.group(1)}.pdf"
-    m_pdf = ARXIV_PDF.match(url)
-    if m_pdf:
+    m = ARXIV.match(url)
+    if not m:
+        return None
+    abs_id, pdf_id = m.groups()
+    if pdf_id:
         return url
-    return None
+    return f"https://arxiv.org/pdf/{abs_id}.pdf"
+
+
+def normalize_url(url: str) -> str:
+    """Canonical form of a paper URL, used as the cache key.
+
+    Lowercases scheme/host, drops the fragment and trailing slashes, and folds
+    arXiv PDF links onto their /abs/ page so both forms share one entry.
+    """
+    parts = urlsplit(url.strip())
+    normalized = urlunsplit((
+        parts.scheme.lower(),
+        parts.netloc.lower(),
+        parts.path.rstrip("/"),
+        parts.query,
+        "",
+    ))
+    m = ARXIV.fullmatch(normalized)
+    if m:
+        return f"https://arxiv.org/abs/{m.group(1) or m.group(2)}"
+    return normalized
 
 
-def _fetch(url: str) -> requests.Response:
-    resp = requests.get(url, headers=HEADERS, timeout=45)
+def _fetch(url: str, stream: bool = False) -> requests.Response:
+    resp = requests.get(url, headers=HEADERS, timeout=45, stream=stream)
     resp.raise_for_status()
     return resp
 
 
-def _extract_from_pdf_bytes(pdf_bytes: bytes) -> str:
-    with io.BytesIO(pdf_bytes) as f:
-        text = pdf_extract_text(f)
-    return text
+def _extract_from_pdf_response(resp: requests.Response) -> str:
+    """Extract text from a streamed PDF response without buffering the whole body.
+
+    PDFium needs a seekable file (the xref table sits at the end of the PDF),
+    so the body is copied chunk by chunk into a spooled temp file.
+    """
+    with resp, tempfile.SpooledTemporaryFile(max_size=PDF_SPOOL_MAX_BYTES) as f:
+        resp.raw.decode_content = True
+        shutil.copyfileobj(resp.raw, f, STREAM_CHUNK_BYTES)
+        f.seek(0)
+        return _extract_from_pdf_file(f)
+
+
+def _extract_from_pdf_file(f) -> str:
+    pdf = pdfium.PdfDocument(f)
+    try:
+        pages = []
+        for page in pdf:
+            textpage = page.get_textpage()
+            pages.append(textpage.get_text_range())
+            textpage.close()
+            page.close()
+        return "\n".join(pages)
+    finally:
+        pdf.close()
 
 
 def _extract_from_html(html: str) -> str:
-    soup = BeautifulSoup(html, "html.parser")
+    tree = LexborHTMLParser(html)
     # Prefer article-like content if available
     for sel in ["article", "main", "#content", ".content", "#paper", "#abs"]:
-        node = soup.select_one(sel)
+        node = tree.css_first(sel)
         if node:
-            return "\n".join(p.get_text(" ", strip=True) for p in node.find_all(["p", "li"]))
+            return "\n".join(p.text(separator=" ", strip=True) for p in node.css("p, li"))
     # Fallback: all paragraphs
-    return "\n".join(p.get_text(" ", strip=True) for p in soup.find_all("p"))
+    return "\n".join(p.text(separator=" ", strip=True) for p in tree.css("p"))
 
 
 def extract_text_from_url(url: str) -> str:
     """Extract text from arXiv (PDF), direct PDF, or generic HTML."""
+    # The memo is keyed on the normalized URL so equivalent links share a hit,
+    # but the URL the caller gave is what gets fetched
+    key = normalize_url(url)
+    text_z = _EXTRACT_MEMO.get(key)
+    if text_z is None:
+        text_z = zlib.compress(_extract_text(url).encode("utf-8"), 1)
+        _EXTRACT_MEMO[key] = text_z
+    _EXTRACT_MEMO.move_to_end(key)
+    while len(_EXTRACT_MEMO) > EXTRACT_MEMO_MAX_ENTRIES:
+        _EXTRACT_MEMO.popitem(last=False)
+    return zlib.decompress(text_z).decode("utf-8")
+
+
+def _extract_text(url: str) -> str:
     # 1) arXiv convenience
     pdf_url = _to_arxiv_pdf(url)
     if pdf_url:
-        resp = _fetch(pdf_url)
-        return _extract_from_pdf_bytes(resp.content)
+        return _extract_from_pdf_response(_fetch(pdf_url, stream=True))
 
     # 2) direct PDF
     if url.lower().endswith(".pdf"):
-        resp = _fetch(url)
-        return _extract_from_pdf_bytes(resp.content)
+        return _extract_from_pdf_response(_fetch(url, stream=True))
 
-    # 3) generic HTML
-    resp = _fetch(url)
+    # 3) generic HTML (stream so a PDF served without a .pdf suffix isn't buffered)
+    resp = _fetch(url, stream=True)
     ctype = resp.headers.get("Content-Type", "").lower()
     if "pdf" in ctype:
-        return _extract_from_pdf_bytes(resp.content)
-    return _extract_from_html(resp.text)
+        return _extract_from_pdf_response(resp)
+    with resp:
+        return _extract_from_html(resp.text)
@@ -1,44 +1,112 @@
 import json
 import os
 import hashlib
-import boto3
+import ijson
+import orjson
 import time
-from typing import Dict, Any
-from botocore.exceptions import ClientError
-from google import genai  # provided by the layer
+import zstandard as zstd
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+from urllib.parse import quote
+from urllib.request import Request, urlopen
+from typing import Dict, Any, Tuple
+
+# llm.py reads GEMINI_MODEL when it is imported, so export the model name once here first
+MODEL_NAME = os.environ.get("MODEL_NAME", "gemini-2.5-flash")
+os.environ["GEMINI_MODEL"] = MODEL_NAME
 
 # Import shared modules
-from extractors import extract_text_from_url
-from llm import summarize_map_reduce
+from extractors import extract_text_from_url, normalize_url
+from llm import summarize_map_reduce, summarize_map_reduce_multi
 
 # AWS Configuration
 SECRET_NAME = os.environ.get("GEMINI_SECRET_NAME", "prod/gemini/api_key")
-MODEL_NAME = os.environ.get("MODEL_NAME", "gemini-2.5-flash")
-REGION = os.environ.get("AWS_REGION") or os.environ.get("AWS_DEFAULT_REGION")
+# Port of the AWS Parameters and Secrets Lambda Extension (attached as a layer)
+SECRETS_EXTENSION_PORT = os.environ.get("PARAMETERS_SECRETS_EXTENSION_HTTP_PORT", "2773")
 S3_BUCKET = os.environ.get("CACHE_BUCKET_NAME", "chat-cache-rraghu214-14092025")
 
 # S3 Configuration
 CACHE_PREFIX = "paper_cache/"
+# Each paper gets its own prefix holding the (large) text and one small object per summary
+# level ("<LEVEL>.json"), all write-once: a cached summary is served without touching the
+# text, and adding a level doesn't re-upload it. The text object is zstd-compressed JSON;
+# paper text shrinks ~3-5x, cutting S3 transfer time.
+TEXT_OBJECT = "text.json.zst"
+_ZCTX = zstd.ZstdCompressor(level=3)
+_DCTX = zstd.ZstdDecompressor()
 VALID_LEVELS = {"LOW", "MEDIUM", "HIGH"}
 
+# Request bodies are a few hundred bytes of JSON; reject anything this large before parsing it
+MAX_BODY_CHARS = 1_000_000
+
+# Response headers, built once per container and shared (read-only) by every response
+RESPONSE_HEADERS = {
+    # 'Access-Control-Allow-Origin': '*',
+    'Access-Control-Allow-Headers': 'Content-Type, Authorization, X-Requested-With',
+    'Access-Control-Allow-Methods': 'POST, OPTIONS, GET',
+    'Access-Control-Max-Age': '86400',  # Cache preflight for 24 hours
+    'Content-Type': 'application/json' # nothing
+}
+
 # Global caches
 _API_KEY_CACHE = None
 _CLIENT_CACHE = None
 
-# Initialize AWS clients
-s3_client = boto3.client('s3')
+# Warm-container copy of the small summary objects (s3_key -> (stored_at, cached_data)),
+# LRU-bounded. Summaries are write-once, so a hit is served without asking S3; entries
+# expire with the bucket's 1-hour lifecycle rule. Paper text is not kept: it is large
+# and the extractor memo already holds it compressed.
+S3_MEMO_MAX_ENTRIES = 96  # 32 papers x 3 levels
+S3_MEMO_TTL_SECONDS = 3600
+_S3_MEMO: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+_S3_MEMO_LOCK = Lock()  # cache writes run concurrently
+
+# Set DEBUG_LOG=1 to log full incoming events
+DEBUG_LOG = os.environ.get("DEBUG_LOG") == "1"
+
+# Set WARM_ON_INIT=0 to skip pre-loading clients during Lambda init (see bottom of module)
+WARM_ON_INIT = os.environ.get("WARM_ON_INIT", "1") == "1"
+
+# AWS clients, created on first use so boto3 is only imported when actually needed
+_S3_CLIENT = None
+
+
+def _s3():
+    """Shared S3 client (lazy: importing boto3/botocore dominates cold-start init)."""
+    global _S3_CLIENT
+    if _S3_CLIENT is None:
+        import boto3
+        from botocore.config import Config
+        # Keep-alive connections are reused across warm invocations; short timeouts and
+        # a single retry keep a slow S3 cache from dominating request latency
+        _S3_CLIENT = boto3.client('s3', config=Config(
+            max_pool_connections=25,
+            retries={'max_attempts': 2, 'mode': 'standard'},
+            tcp_keepalive=True,
+            connect_timeout=1,
+            read_timeout=5,
+        ))
+    return _S3_CLIENT
 
 
 def _get_api_key():
-    """Fetch and cache the API key from Secrets Manager."""
+    """Fetch and cache the API key via the AWS Parameters and Secrets Lambda Extension."""
     global _API_KEY_CACHE
     if _API_KEY_CACHE:
         return _API_KEY_CACHE
 
     try:
-        sm = boto3.client("secretsmanager", region_name=REGION)
-        print(f"Fetching secret: {SECRET_NAME} from region: {REGION}")
-        sec = sm.get_secret_value(SecretId=SECRET_NAME)
+        # The extension serves (and caches) secrets on localhost, so no boto3 client or
+        # signed Secrets Manager call is needed on cold start
+        secret_url = (
+            f"http://localhost:{SECRETS_EXTENSION_PORT}/secretsmanager/get"
+            f"?secretId={quote(SECRET_NAME, safe='')}"
+        )
+        req = Request(secret_url, headers={"X-Aws-Parameters-Secrets-Token": os.environ["AWS_SESSION_TOKEN"]})
+        print(f"Fetching secret: {SECRET_NAME} via Lambda extension on port {SECRETS_EXTENSION_PORT}")
+        with urlopen(req, timeout=5) as resp:
+            sec = json.loads(resp.read())
         s = sec["SecretString"]
         print(f"Secret fetched successfully, length: {len(s) if s else 0}")
 
@@ -55,9 +123,6 @@ def _get_api_key():
             raise ValueError("API key is empty")
             
         _API_KEY_CACHE = api_key.strip()
-        
-        # Set the environment variable so llm.py can use it
-        os.environ["GEMINI_API_KEY"] = _API_KEY_CACHE
         print(f"API key cached successfully, length: {len(_API_KEY_CACHE)}")
         
         return _API_KEY_CACHE
@@ -72,50 +137,99 @@ def _get_client():
     if _CLIENT_CACHE:
         return _CLIENT_CACHE
     
-    # Ensure API key is set in environment
+    # Ensure API key is available
     api_key = _get_api_key()
+    from google import genai  # provided by the layer; imported lazily to keep init light
     _CLIENT_CACHE = genai.Client(api_key=api_key)
     return _CLIENT_CACHE
 
 
-def cache_paper_s3(url: str, text: str, summaries: Dict[str, str]) -> None:
-    """Cache paper data in S3"""
-    cache_key = hashlib.md5(url.encode()).hexdigest()
-    s3_key = f"{CACHE_PREFIX}{cache_key}.json"
-    
-    cache_data = {
-        "text": text,
-        "summaries": summaries,
-        "url": url,
-        "timestamp": int(time.time())
-    }
-    
+def _url_key(url: str) -> str:
+    """Hash a URL for use in S3 keys; BLAKE2b is cheaper than MD5 for short inputs"""
+    return hashlib.blake2b(url.encode('utf-8'), digest_size=16).hexdigest()
+
+
+def _s3_prefix_for(url: str) -> str:
+    """S3 key prefix under which a paper URL's cache objects live"""
+    return f"{CACHE_PREFIX}{_url_key(url)}/"
+
+
+def _memo_s3(s3_key: str, cached_data: Dict[str, Any]) -> None:
+    """Remember an S3 cache object, evicting the least recently used"""
+    with _S3_MEMO_LOCK:
+        _S3_MEMO[s3_key] = (time.monotonic(), cached_data)
+        _S3_MEMO.move_to_end(s3_key)
+        while len(_S3_MEMO) > S3_MEMO_MAX_ENTRIES:
+            _S3_MEMO.popitem(last=False)
+
+
+def _memo_get_s3(s3_key: str) -> Dict[str, Any] | None:
+    """Return a remembered S3 cache object unless it has outlived the bucket lifecycle"""
+    with _S3_MEMO_LOCK:
+        entry = _S3_MEMO.get(s3_key)
+        if entry is None:
+            return None
+        if time.monotonic() - entry[0] > S3_MEMO_TTL_SECONDS:
+            del _S3_MEMO[s3_key]
+            return None
+        _S3_MEMO.move_to_end(s3_key)
+        return entry[1]
+
+
+def _load_cache_stream(body) -> Dict[str, Any]:
+    """Parse a cached JSON object straight off the (decompressing) S3 stream.
+
+    Top-level keys are materialized one at a time, so the raw JSON body is never
+    buffered in full next to the parsed dict (the paper text dominates its size).
+    """
+    return dict(ijson.kvitems(body, '', use_float=True))
+
+
+def _put_s3(s3_key: str, data: Dict[str, Any], compress: bool) -> None:
+    """Write one cache object to S3; failures are logged, never raised"""
+    body = orjson.dumps(data)
+    extra = {}
+    if compress:
+        body = _ZCTX.compress(body)
+        extra['ContentEncoding'] = 'zstd'
     try:
-        s3_client.put_object(
+        _s3().put_object(
             Bucket=S3_BUCKET,
             Key=s3_key,
-            Body=json.dumps(cache_data, ensure_ascii=False),
+            Body=body,
             ContentType='application/json',
-            ServerSideEncryption='AES256'  # Optional: encrypt at rest
+            ServerSideEncryption='AES256',  # Optional: encrypt at rest
+            **extra
         )
-        print(f"Cached paper data to S3: {s3_key}")
+        if not compress:
+            _memo_s3(s3_key, data)
+        print(f"Cached data to S3: {s3_key}")
     except Exception as e:
         print(f"Error caching to S3: {str(e)}")
         # Don't raise - caching failure shouldn't break the main functionality
 
 
-def get_cached_paper_s3(url: str) -> Dict[str, Any] | None:
-    """Retrieve cached paper data from S3"""
-    cache_key = hashlib.md5(url.encode()).hexdigest()
-    s3_key = f"{CACHE_PREFIX}{cache_key}.json"
-    
+def _get_s3(s3_key: str, compressed: bool) -> Dict[str, Any] | None:
+    """Read one cache object, from the warm-container memo (summaries) or S3"""
+    from botocore.exceptions import ClientError
+
+    if not compressed:
+        memo = _memo_get_s3(s3_key)
+        if memo is not None:
+            print(f"Retrieved cached data from memory: {s3_key}")
+            return memo
     try:
-        response = s3_client.get_object(Bucket=S3_BUCKET, Key=s3_key)
-        cached_data = json.loads(response['Body'].read().decode('utf-8'))
-        print(f"Retrieved cached paper data from S3: {s3_key}")
-        return cached_data
+        response = _s3().get_object(Bucket=S3_BUCKET, Key=s3_key)
+        if compressed:
+            data = _load_cache_stream(_DCTX.stream_reader(response['Body']))
+        else:
+            data = orjson.loads(response['Body'].read())
+            _memo_s3(s3_key, data)
+        print(f"Retrieved cached data from S3: {s3_key}")
+        return data
     except ClientError as e:
-        if e.response['Error']['Code'] == 'NoSuchKey':
+        code = e.response['Error']['Code']
+        if code == 'NoSuchKey':
             print(f"No cached data found for: {s3_key}")
             return None
         print(f"Error retrieving from S3: {str(e)}")
@@ -125,17 +239,46 @@ def get_cached_paper_s3(url: str) -> Dict[str, Any] | None:
         return None
 
 
+def _write_text_s3(s3_prefix: str, url: str, text: str) -> None:
+    """Cache a paper's extracted text (written once per paper)"""
+    _put_s3(f"{s3_prefix}{TEXT_OBJECT}", {
+        "text": text,
+        "url": url,
+        "timestamp": int(time.time())
+    }, compress=True)
+
+
+def _write_summary_s3(s3_prefix: str, level: str, summary: str) -> None:
+    """Cache one complexity level's summary (small, write-once object)"""
+    _put_s3(f"{s3_prefix}{level}.json", {"summary": summary}, compress=False)
+
+
+def _write_paper_s3(s3_prefix: str, url: str, text: str | None, summaries: Dict[str, str]) -> None:
+    """Write a paper's new cache objects concurrently (the text only when given)"""
+    with ThreadPoolExecutor(max_workers=len(summaries) + 1) as ex:
+        if text is not None:
+            ex.submit(_write_text_s3, s3_prefix, url, text)
+        for level, summary in summaries.items():
+            ex.submit(_write_summary_s3, s3_prefix, level, summary)
+
+
+def get_cached_text_s3(s3_prefix: str) -> str | None:
+    """Retrieve a paper's cached extracted text from S3"""
+    data = _get_s3(f"{s3_prefix}{TEXT_OBJECT}", compressed=True)
+    return data["text"] if data else None
+
+
+def get_cached_summary_s3(s3_prefix: str, level: str) -> str | None:
+    """Retrieve a cached summary for one complexity level from S3"""
+    data = _get_s3(f"{s3_prefix}{level}.json", compressed=False)
+    return data["summary"] if data else None
+
+
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     """Lambda handler for paper summarization"""
     
-    # Set up CORS headers - MUST be consistent across all responses
-    headers = {
-        # 'Access-Control-Allow-Origin': '*',
-        'Access-Control-Allow-Headers': 'Content-Type, Authorization, X-Requested-With',
-        'Access-Control-Allow-Methods': 'POST, OPTIONS, GET',
-        'Access-Control-Max-Age': '86400',  # Cache preflight for 24 hours
-        'Content-Type': 'application/json' # nothing
-    }
+    # CORS headers - MUST be consistent across all responses
+    headers = RESPONSE_HEADERS
     
     # Handle OPTIONS request for CORS preflight - CRITICAL: Must return 200
     if event.get('httpMethod') == 'OPTIONS':
@@ -146,17 +289,26 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'body': json.dumps({'message': 'CORS preflight successful'})
         }
     
-    # Log the incoming event for debugging
-    print(f"Received event: {json.dumps(event, default=str)}")
+    # Log the incoming event; the full dump (whole body included) only when DEBUG_LOG=1
+    if DEBUG_LOG:
+        print(f"Received event: {json.dumps(event, default=str)}")
+    else:
+        print(f"Received {event.get('httpMethod')} request, body length: {len(event.get('body') or '')}")
     
     try:
         # Parse request body with better error handling
         body = None
         if 'body' in event and event['body']:
             if isinstance(event['body'], str):
+                if len(event['body']) > MAX_BODY_CHARS:
+                    return {
+                        'statusCode': 413,
+                        'headers': headers,
+                        'body': json.dumps({'error': 'Request body too large'})
+                    }
                 try:
-                    body = json.loads(event['body'])
-                except json.JSONDecodeError as e:
+                    body = orjson.loads(event['body'])
+                except orjson.JSONDecodeError as e:
                     print(f"JSON decode error: {str(e)}")
                     return {
                         'statusCode': 400,
@@ -199,11 +351,6 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         try:
             # Initialize client and ensure API key is available
             client = _get_client()
-            
-            # Also set the model name if provided
-            if MODEL_NAME:
-                os.environ["GEMINI_MODEL"] = MODEL_NAME
-                
         except Exception as e:
             print(f"Error initializing Gemini client: {str(e)}")
             return {
@@ -212,40 +359,51 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 'body': json.dumps({'error': f'Failed to initialize Gemini client: {str(e)}'})
             }
         
-        # Check S3 cache first
-        cached_data = get_cached_paper_s3(url)
+        # Check S3 cache first, keyed on the normalized URL so equivalent links share an entry.
+        # A cached summary is a small object of its own, so hits never fetch the paper text.
+        cache_url = normalize_url(url)
+        s3_prefix = _s3_prefix_for(cache_url)
+        summary = get_cached_summary_s3(s3_prefix, level)
         
-        if cached_data is None:
-            # Extract text from URL
-            try:
-                text = extract_text_from_url(url)
-                if not text or len(text.strip()) < 200:
+        if summary is None:
+            text = get_cached_text_s3(s3_prefix)
+            text_is_new = text is None
+            
+            if text is None:
+                # Extract text from URL
+                try:
+                    text = extract_text_from_url(url)
+                    if not text or len(text.strip()) < 200:
+                        return {
+                            'statusCode': 400,
+                            'headers': headers,
+                            'body': json.dumps({'error': 'Could not extract enough text from the provided URL'})
+                        }
+                    
+                except Exception as e:
+                    print(f"Error extracting text: {str(e)}")
                     return {
-                        'statusCode': 400,
+                        'statusCode': 500,
                         'headers': headers,
-                        'body': json.dumps({'error': 'Could not extract enough text from the provided URL'})
+                        'body': json.dumps({'error': f'Error extracting text: {str(e)}'})
                     }
-                
-                # Initialize cache entry
-                cached_data = {"text": text, "summaries": {}}
-                cache_paper_s3(url, text, {})
-                
-            except Exception as e:
-                print(f"Error extracting text: {str(e)}")
-                return {
-                    'statusCode': 500,
-                    'headers': headers,
-                    'body': json.dumps({'error': f'Error extracting text: {str(e)}'})
-                }
-        
-        # Generate summary if not cached
-        if level not in cached_data["summaries"]:
+            
+            # Generate summary
             try:
-                summary = summarize_map_reduce(cached_data["text"], level=level)
-                cached_data["summaries"][level] = summary
+                summaries = None
+                if text_is_new:
+                    # New paper: produce every level in one pass so later level switches
+                    # are cache hits; fall back to the single-level path if that fails
+                    try:
+                        summaries = summarize_map_reduce_multi(text, client=client)
+                    except Exception as e:
+                        print(f"Multi-level summary failed, falling back to {level} only: {str(e)}")
+                if summaries is None:
+                    summaries = {level: summarize_map_reduce(text, level=level, client=client)}
+                summary = summaries[level]
                 
-                # Update S3 cache
-                cache_paper_s3(url, cached_data["text"], cached_data["summaries"])
+                # Update S3 cache; the text only needs writing the first time
+                _write_paper_s3(s3_prefix, cache_url, text if text_is_new else None, summaries)
                 
             except Exception as e:
                 print(f"Error generating summary: {str(e)}")
@@ -263,7 +421,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 'success': True,
                 'paper_url': url,
                 'level': level,
-                'summary': cached_data["summaries"][level],
+                'summary': summary,
                 'session_id': session_id
             })
         }
@@ -274,4 +432,19 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'statusCode': 500,
             'headers': headers,
             'body': json.dumps({'error': f'Internal server error: {str(e)}'})
-        }
\ No newline at end of file
+        }
+
+
+# Fetch the secret and build the Gemini and S3 clients during Lambda init (once per container)
+# rather than on the first request. Failures are only logged so the module still imports;
+# handler() retries through _get_client() and reports the error to the caller.
+if WARM_ON_INIT:
+    # Separate tries so a Gemini failure still leaves S3 warmed, and vice versa
+    try:
+        _get_client()
+    except Exception as e:
+        print(f"Gemini client warm-up during init failed: {str(e)}")
+    try:
+        _s3()
+    except Exception as e:
+        print(f"S3 client warm-up during init failed: {str(e)}")
@@ -1,13 +1,23 @@
+import json
 import os
 import math
-from typing import List, Dict, Optional
-from google import genai
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Dict, Optional, Sequence, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from google import genai
 
 # Model selection
 # Defaults to Gemini Flash 2.x name. You can change via GEMINI_MODEL env var.
 # If you have access to a specific preview like "gemini-2.5-flash", set it there.
 GEMINI_MODEL = os.environ.get("GEMINI_MODEL", "gemini-2.5-flash")
 
+# Upper bound on concurrent Gemini calls during the map step
+MAP_MAX_WORKERS = int(os.environ.get("MAP_MAX_WORKERS", "8"))
+
+# Complexity levels produced together by summarize_map_reduce_multi
+ALL_LEVELS = ("LOW", "MEDIUM", "HIGH")
+
 # Global client cache for reuse
 _GLOBAL_CLIENT = None
 
@@ -22,6 +32,7 @@ def get_gemini_client():
     if not GEMINI_API_KEY:
         raise RuntimeError("GEMINI_API_KEY env var is required")
     
+    from google import genai  # imported lazily to keep module import light
     _GLOBAL_CLIENT = genai.Client(api_key=GEMINI_API_KEY)
     return _GLOBAL_CLIENT
 
@@ -31,10 +42,14 @@ def set_gemini_client(client):
     _GLOBAL_CLIENT = client
 
 # -------------- Prompt helpers --------------
-from prompts import CHUNK_SUMMARY_PROMPT, REDUCE_SUMMARY_PROMPT, CHAT_PROMPT
+from prompts import CHUNK_SUMMARY_PROMPT, MULTI_CHUNK_SUMMARY_PROMPT, REDUCE_SUMMARY_PROMPT, CHAT_PROMPT
 
+# CHAT_PROMPT has a single {context} slot; pre-split it so the (large) context
+# is spliced in by concatenation instead of re-parsing the template every turn.
+_CHAT_PREFIX, _CHAT_SUFFIX = CHAT_PROMPT.split("{context}")
 
-def _call_gemini(contents: List[Dict], client: Optional[genai.Client] = None) -> str:
+
+def _call_gemini(contents: List[Dict], client: Optional["genai.Client"] = None, config: Optional[Dict] = None) -> str:
     """Low-level call using client.models.generate_content; returns text."""
     if client is None:
         client = get_gemini_client()
@@ -42,6 +57,7 @@ def _call_gemini(contents: List[Dict], client: Optional[genai.Client] = None) ->
     resp = client.models.generate_content(
         model=GEMINI_MODEL,
         contents=contents,
+        config=config,
     )
     # The SDK exposes either resp.output_text or resp.text depending on version
     text = getattr(resp, "output_text", None) or getattr(resp, "text", None)
@@ -54,47 +70,84 @@ def _call_gemini(contents: List[Dict], client: Optional[genai.Client] = None) ->
     return text
 
 
+def _bind_prompt(template: str, slot: str, **fixed: str) -> Callable[[str], str]:
+    """Format `template` once with the `fixed` fields; return a filler for the `slot` field.
+
+    The returned callable splices its argument in by concatenation, so the
+    template is not re-parsed for every chunk.
+    """
+    marker = "{" + slot + "}"
+    prefix, suffix = template.format(**fixed, **{slot: marker}).split(marker)
+    return lambda value: prefix + value + suffix
+
+
 def _split_text(text: str, max_chars: int = 20000, overlap: int = 800) -> List[str]:
-    """Simple word-safe chunking to keep prompts reasonably sized."""
-    if len(text) <= max_chars:
+    """Simple word-safe chunking to keep prompts reasonably sized.
+
+    Slices the original string directly, backing each cut off to the nearest
+    whitespace, so no per-word list is ever built.
+    """
+    n = len(text)
+    if n <= max_chars:
         return [text]
-    words = text.split()
     chunks = []
-    cur = []
-    cur_len = 0
-    for w in words:
-        lw = len(w) + 1
-        if cur_len + lw > max_chars:
-            chunks.append(" ".join(cur))
-            # start new with overlap from tail
-            tail = " ".join(cur)[-overlap:]
-            cur = [tail]
-            cur_len = len(tail)
-        cur.append(w)
-        cur_len += lw
-    if cur:
-        chunks.append(" ".join(cur))
-    return chunks
-
-
-def summarize_map_reduce(full_text: str, level: str = "LOW", client: Optional[genai.Client] = None) -> str:
+    start = 0
+    while True:
+        end = min(start + max_chars, n)
+        if end < n:
+            # don't cut mid-word: back off to the last whitespace in the window
+            cut = max(text.rfind(" ", start, end), text.rfind("\n", start, end))
+            if cut > start:
+                end = cut
+        chunks.append(text[start:end])
+        if end >= n:
+            return chunks
+        # start next with overlap from tail, beginning on a word boundary
+        nxt = end - overlap
+        if nxt > start:
+            ws = min(i for i in (text.find(" ", nxt, end), text.find("\n", nxt, end), end) if i != -1)
+            start = ws + 1 if ws < end else nxt
+        else:
+            start = end
+
+
+def _call_gemini_many(prompts: List[str], client: Optional["genai.Client"] = None, config: Optional[Dict] = None) -> List[str]:
+    """One single-turn Gemini call per prompt, fanned out since each is independent I/O.
+
+    Results are returned in prompt order.
+    """
+    if client is None:
+        # Resolve once so worker threads share a single client
+        client = get_gemini_client()
+
+    def _call(prompt: str) -> str:
+        contents = [
+            {"role": "user", "parts": [{"text": prompt}]}
+        ]
+        return _call_gemini(contents, client, config)
+
+    with ThreadPoolExecutor(max_workers=min(MAP_MAX_WORKERS, len(prompts))) as ex:
+        # map() preserves prompt order
+        return list(ex.map(_call, prompts))
+
+
+def summarize_map_reduce(full_text: str, level: str = "LOW", client: Optional["genai.Client"] = None) -> str:
     """Map-reduce summarization across chunks with a final synthesis.
     level in {LOW, MEDIUM, HIGH}
     """
     chunks = _split_text(full_text)
 
     # 1) Map step: per-chunk summaries
-    partials: List[str] = []
-    for i, chunk in enumerate(chunks, 1):
-        prompt = CHUNK_SUMMARY_PROMPT.format(level=level, chunk=chunk)
-        contents = [
-            {"role": "user", "parts": [{"text": prompt}]}
-        ]
-        partial = _call_gemini(contents, client)
-        partials.append(partial)
+    make_chunk_prompt = _bind_prompt(CHUNK_SUMMARY_PROMPT, "chunk", level=level)
+    partials = _call_gemini_many([make_chunk_prompt(chunk) for chunk in chunks], client)
+
+    # A single chunk's summary already covers the whole paper; no need to re-summarize it
+    if len(partials) == 1:
+        return partials[0]
 
     # 2) Reduce step: synthesize into a single coherent summary at the same level
-    reduce_prompt = REDUCE_SUMMARY_PROMPT.format(level=level, partials="\n\n".join(partials))
+    make_reduce_prompt = _bind_prompt(REDUCE_SUMMARY_PROMPT, "partials", level=level)
+    reduce_prompt = make_reduce_prompt("\n\n".join(partials))
     contents = [
         {"role": "user", "parts": [{"text": reduce_prompt}]}
     ]
@@ -102,7 +155,43 @@ def summarize_map_reduce(full_text: str, level: str = "LOW", client: Optional[ge
     return final_summary
 
 
-def chat_answer(doc_text: str, history: List[Dict[str, str]], max_context_chars: int = 60000, client: Optional[genai.Client] = None) -> str:
+def _parse_levels(text: str, levels: Sequence[str]) -> Dict[str, str]:
+    """Parse a {level: summary} JSON object out of a model response."""
+    # Tolerate code fences or stray text around the object
+    data = json.loads(text[text.find("{"):text.rfind("}") + 1])
+    return {level: data[level] for level in levels}
+
+
+def summarize_map_reduce_multi(full_text: str, levels: Sequence[str] = ALL_LEVELS, client: Optional["genai.Client"] = None) -> Dict[str, str]:
+    """Summarize at several complexity levels in one pass; returns {level: summary}.
+
+    Each chunk is mapped once with a prompt asking for every level, so a paper
+    costs N + len(levels) calls instead of len(levels) * (N + 1).
+    """
+    chunks = _split_text(full_text)
+    if client is None:
+        client = get_gemini_client()
+
+    # 1) Map step: one call per chunk returning every level as JSON
+    make_chunk_prompt = _bind_prompt(MULTI_CHUNK_SUMMARY_PROMPT, "chunk", levels=", ".join(levels))
+    responses = _call_gemini_many(
+        [make_chunk_prompt(chunk) for chunk in chunks], client, {"response_mime_type": "application/json"}
+    )
+    partials = [_parse_levels(response, levels) for response in responses]
+
+    # A single chunk's summaries already cover the whole paper
+    if len(partials) == 1:
+        return partials[0]
+
+    # 2) Reduce step: one synthesis per level, run concurrently
+    reduce_prompts = [
+        _bind_prompt(REDUCE_SUMMARY_PROMPT, "partials", level=level)("\n\n".join(p[level] for p in partials))
+        for level in levels
+    ]
+    return dict(zip(levels, _call_gemini_many(reduce_prompts, client)))
+
+
+def chat_answer(doc_text: str, history: List[Dict[str, str]], max_context_chars: int = 60000, client: Optional["genai.Client"] = None) -> str:
     """Answer a user question grounded in doc_text and chat history.
 
     history: list of {role: 'user'|'model', text: str}
@@ -114,7 +203,7 @@ def chat_answer(doc_text: str, history: List[Dict[str, str]], max_context_chars:
     contents: List[Dict] = []
 
     # Add system-like instruction by putting it in the first user message
-    system_user_message = CHAT_PROMPT.format(context=context)
+    system_user_message = _CHAT_PREFIX + context + _CHAT_SUFFIX
     contents.append({"role": "user", "parts": [{"text": system_user_message}]})
 
     for turn in history:
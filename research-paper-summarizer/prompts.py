@@ -12,6 +12,20 @@ CHUNK_SUMMARY_PROMPT = (
     "CHUNK:\n{chunk}\n"
 )
 
+MULTI_CHUNK_SUMMARY_PROMPT = (
+    "You are analyzing an academic paper. Summarize the following CHUNK in English, "
+    "once for EACH of these complexity levels: {levels}.\n"
+    "Focus on: problem statement, motivation, key ideas/methods, experiments, results, limitations.\n"
+    "- LOW  => explain in layman terms and concise bullet points.\n"
+    "- MEDIUM => provide intuition and a bit of math/CS detail where helpful.\n"
+    "- HIGH => advanced/technical explanation for experts.\n\n"
+    "Return ONLY a JSON object mapping each level name to its summary, e.g. "
+    "{{\"LOW\": \"...\", \"MEDIUM\": \"...\", \"HIGH\": \"...\"}}.\n"
+    "Each summary must be clean HTML using <h2>, <p>, and <ul><li> for structure.\n"
+    "Do not include any extraneous text outside the JSON object.\n\n"
+    "CHUNK:\n{chunk}\n"
+)
+
 REDUCE_SUMMARY_PROMPT = (
     "Synthesize a cohesive paper summary from these PARTIAL chunk summaries.\n"
     "Maintain the {level} complexity target.\n"